@@ -495,7 +495,7 @@ const App = {
 
             let history = null;
             if (historyResp && historyResp.ok) {
-                history = await historyResp.json();
+                history = Utils.historyToRows(await historyResp.json());
             }
 
             this.renderCompanyHeader(company, fundamentals);
@@ -1,6 +1,6 @@
 /**
  * Chart widget using TradingView lightweight-charts.
- * Loads OHLCV data from data/history/{ticker}.json.
+ * Loads columnar OHLCV data from data/history/{ticker}.json.
  */
 
 const ChartWidget = {
@@ -70,7 +70,7 @@ const ChartWidget = {
         try {
             const resp = await fetch(`data/history/${filename}.json`);
             if (!resp.ok) throw new Error('Historique non disponible');
-            this.historyData = await resp.json();
+            this.historyData = Utils.historyToRows(await resp.json());
             this.renderChart();
         } catch (e) {
             const container = document.getElementById(this.containerId);
@@ -63,6 +63,21 @@ const Utils = {
         return ticker.replace(/\./g, '_').replace(/-/g, '_');
     },
 
+    /**
+     * Convertit un historique colonnaire {time: [...], open: [...], ...}
+     * en lignes [{time, open, high, low, close, volume}, ...].
+     * Les anciens fichiers deja en lignes sont renvoyes tels quels.
+     */
+    historyToRows(history) {
+        if (!history || Array.isArray(history)) return history;
+        const keys = Object.keys(history);
+        return (history.time || []).map((_, i) => {
+            const row = {};
+            keys.forEach(k => { row[k] = history[k][i]; });
+            return row;
+        });
+    },
+
     getUrlParam(name) {
         return new URLSearchParams(window.location.search).get(name);
     },
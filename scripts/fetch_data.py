@@ -3,12 +3,17 @@ Script principal de recuperation des donnees financieres via yfinance.
 Execute quotidiennement par GitHub Actions (22h UTC, lun-ven).
 """
 
-import json
+import math
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 
+import numpy as np
+import orjson
+import pandas as pd
 import yfinance as yf
 
 from companies_config import COMPANIES, COUNTRIES, INDICES, get_all_companies, ticker_to_filename
@@ -25,19 +30,77 @@ FUNDAMENTALS_DIR.mkdir(parents=True, exist_ok=True)
 NEWS_DIR.mkdir(parents=True, exist_ok=True)
 HISTORY_DIR.mkdir(parents=True, exist_ok=True)
 
+# Parallelisme des appels par entreprise (fondamentaux, actualites)
+MAX_WORKERS = 10
+
+
+class RateLimiter:
+    """Seau a jetons partage entre threads : `rate` appels/s en regime etabli, rafales jusqu'a `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Jeton reserve meme si le seau est vide : l'attente est calculee sur la dette
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Limiteurs partages entre les workers : pas d'attente tant que la rafale n'est pas
+# consommee, puis meme debit que l'ancienne boucle serie (1.5s / 0.5s par ticker)
+FUNDAMENTALS_LIMITER = RateLimiter(rate=1 / 1.5, burst=MAX_WORKERS)
+NEWS_LIMITER = RateLimiter(rate=2, burst=MAX_WORKERS)
+
+# sector/industry des fondamentaux recuperes pendant ce run, par ticker
+_FUNDAMENTALS_MEMO = {}
+
+# Objets yf.Ticker reutilises entre fondamentaux et actualites
+_TICKER_CACHE = {}
+
+
+def get_ticker(ticker_str):
+    """Retourne l'objet yf.Ticker memorise pour ce ticker (cree au premier appel)."""
+    ticker = _TICKER_CACHE.get(ticker_str)
+    if ticker is None:
+        ticker = _TICKER_CACHE.setdefault(ticker_str, yf.Ticker(ticker_str))
+    return ticker
+
+
+def dump_json(obj, path, pretty=False):
+    """Ecrit obj en JSON UTF-8 via orjson (indentation 2 si pretty)."""
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    Path(path).write_bytes(orjson.dumps(obj, option=option))
+
 
 def generate_companies_json():
     """Genere data/companies.json depuis la config Python, enrichi avec sector/industry."""
     companies = get_all_companies()
 
-    # Enrich each company with sector/industry from its fundamentals file
+    # Enrich each company with sector/industry (memo of this run, else its fundamentals file)
     for company in companies:
+        memo = _FUNDAMENTALS_MEMO.get(company["ticker"])
+        if memo is not None:
+            company["sector"] = memo["sector"]
+            company["industry"] = memo["industry"]
+            continue
+
         filename = ticker_to_filename(company["ticker"])
         fund_path = FUNDAMENTALS_DIR / f"{filename}.json"
         if fund_path.exists():
             try:
-                with open(fund_path, "r", encoding="utf-8") as f:
-                    fund = json.load(f)
+                fund = orjson.loads(fund_path.read_bytes())
                 company["sector"] = fund.get("sector")
                 company["industry"] = fund.get("industry")
             except Exception:
@@ -61,8 +124,7 @@ def generate_companies_json():
         }
 
     path = DATA_DIR / "companies.json"
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    dump_json(output, path, pretty=True)
     print(f"[OK] companies.json genere ({len(companies)} entreprises)")
 
 
@@ -74,42 +136,58 @@ def fetch_batch_prices():
     print(f"[...] Telechargement des prix pour {len(tickers)} tickers...")
     data = yf.download(tickers, period="5d", group_by="ticker", threads=True)
 
+    # Matrices (dates x tickers) des clotures et volumes
+    if isinstance(data.columns, pd.MultiIndex):
+        closes = data.xs("Close", axis=1, level=1)
+        volumes = data.xs("Volume", axis=1, level=1)
+    else:
+        closes = data[["Close"]].set_axis(tickers, axis=1)
+        volumes = data[["Volume"]].set_axis(tickers, axis=1)
+
+    # Derniere et avant-derniere cloture valide de chaque ticker (1 = la plus recente)
+    valid = closes.notna()
+    rank = valid.iloc[::-1].cumsum().iloc[::-1]
+    last_close = closes.where(valid & (rank == 1)).max()
+    prev_close = closes.where(valid & (rank == 2)).max().fillna(last_close)
+    last_volume = volumes.where(valid & (rank == 1)).max().fillna(0)
+    change = last_close - prev_close
+    change_pct = (change / prev_close * 100).where(prev_close != 0, 0)
+
     prices = {}
     for company in all_companies:
         ticker = company["ticker"]
         try:
-            if len(tickers) == 1:
-                ticker_data = data
-            else:
-                ticker_data = data[ticker]
-
-            if ticker_data.empty:
+            if ticker not in last_close.index or pd.isna(last_close[ticker]):
                 continue
 
-            last_row = ticker_data.dropna(how="all").iloc[-1]
-            prev_row = ticker_data.dropna(how="all").iloc[-2] if len(ticker_data.dropna(how="all")) > 1 else None
-
-            close = float(last_row["Close"])
-            prev_close = float(prev_row["Close"]) if prev_row is not None else close
-            change = close - prev_close
-            change_pct = (change / prev_close * 100) if prev_close != 0 else 0
-
             prices[ticker] = {
-                "price": round(close, 2),
-                "change": round(change, 2),
-                "change_pct": round(change_pct, 2),
-                "volume": int(last_row["Volume"]) if "Volume" in last_row.index else 0,
+                "price": round(float(last_close[ticker]), 2),
+                "change": round(float(change[ticker]), 2),
+                "change_pct": round(float(change_pct[ticker]), 2),
+                "volume": int(last_volume[ticker]),
                 "currency": company["currency"],
             }
         except Exception as e:
             print(f"  [ERREUR] Prix {ticker}: {e}")
 
     path = DATA_DIR / "prices.json"
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(prices, f, ensure_ascii=False, indent=2)
+    dump_json(prices, path)
     print(f"[OK] prices.json genere ({len(prices)} tickers)")
 
 
+def last_history_row(history):
+    """Retourne la derniere ligne d'un historique colonnaire sous forme de dict."""
+    return {field: values[-1] for field, values in history.items()}
+
+
+def read_last_history_row(path):
+    """Retourne la derniere ligne d'un fichier d'historique existant (None si absent ou illisible)."""
+    try:
+        return last_history_row(orjson.loads(path.read_bytes()))
+    except Exception:
+        return None
+
+
 def fetch_history():
     """Recupere 1 an d'historique OHLCV quotidien par entreprise."""
     all_companies = get_all_companies()
@@ -118,7 +196,8 @@ def fetch_history():
     print(f"[...] Telechargement historique 5 ans pour {len(tickers)} tickers...")
     data = yf.download(tickers, period="5y", group_by="ticker", threads=True)
 
-    count = 0
+    pending = []
+    unchanged = 0
     for company in all_companies:
         ticker = company["ticker"]
         filename = ticker_to_filename(ticker)
@@ -132,29 +211,42 @@ def fetch_history():
             if df.empty:
                 continue
 
-            history = []
-            for date, row in df.iterrows():
-                o, h, l, c = row.get("Open"), row.get("High"), row.get("Low"), row.get("Close")
-                v = row.get("Volume", 0)
-                if any(x is None or (hasattr(x, '__float__') and str(x) == 'nan') for x in [o, h, l, c]):
-                    continue
-                history.append({
-                    "time": date.strftime("%Y-%m-%d"),
-                    "open": round(float(o), 2),
-                    "high": round(float(h), 2),
-                    "low": round(float(l), 2),
-                    "close": round(float(c), 2),
-                    "volume": int(float(v)) if v and str(v) != 'nan' else 0,
-                })
+            df = df.dropna(subset=["Open", "High", "Low", "Close"])
+            volume = df["Volume"] if "Volume" in df.columns else pd.Series(0, index=df.index)
+            # Format colonnaire : une liste par champ plutot qu'un dict par jour
+            history = {
+                "time": df.index.strftime("%Y-%m-%d").tolist(),
+                "open": df["Open"].round(2).tolist(),
+                "high": df["High"].round(2).tolist(),
+                "low": df["Low"].round(2).tolist(),
+                "close": df["Close"].round(2).tolist(),
+                "volume": volume.fillna(0).astype("int64").tolist(),
+            }
 
+            # Pas de nouvelle seance (week-end, jour ferie) : fichier deja a jour
             path = HISTORY_DIR / f"{filename}.json"
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(history, f)
-            count += 1
+            if history["time"] and last_history_row(history) == read_last_history_row(path):
+                unchanged += 1
+                continue
+
+            pending.append((ticker, path, history))
+        except Exception as e:
+            print(f"  [ERREUR] Historique {ticker}: {e}")
+
+    def write_history(item):
+        ticker, path, history = item
+        try:
+            dump_json(history, path)
+            return True
         except Exception as e:
             print(f"  [ERREUR] Historique {ticker}: {e}")
+            return False
+
+    # Ecritures independantes : on les recouvre via un pool de threads
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        count = sum(executor.map(write_history, pending))
 
-    print(f"[OK] Historique genere ({count} fichiers)")
+    print(f"[OK] Historique genere ({count} fichiers, {unchanged} inchanges)")
 
 
 def fetch_indices():
@@ -178,15 +270,11 @@ def fetch_indices():
                     print(f"  [SKIP] {ticker}: pas de donnees")
                     continue
 
-                series = []
-                for date, row in df.iterrows():
-                    close = row.get("Close")
-                    if close is None or (hasattr(close, '__float__') and str(close) == 'nan'):
-                        continue
-                    series.append({
-                        "time": date.strftime("%Y-%m-%d"),
-                        "value": round(float(close), 2),
-                    })
+                closes = df["Close"].dropna()
+                series = pd.DataFrame({
+                    "time": closes.index.strftime("%Y-%m-%d"),
+                    "value": closes.round(2),
+                }).to_dict(orient="records")
 
                 info = INDICES[ticker]
                 indices_data[ticker] = {
@@ -200,8 +288,7 @@ def fetch_indices():
                 print(f"  [ERREUR] {ticker}: {e}")
 
         path = DATA_DIR / "indices.json"
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(indices_data, f, ensure_ascii=False)
+        dump_json(indices_data, path)
         print(f"[OK] indices.json genere ({len(indices_data)} indices)")
 
     except Exception as e:
@@ -210,20 +297,21 @@ def fetch_indices():
 
 def safe_convert(value):
     """Convertit les valeurs numpy/pandas en types Python natifs."""
-    if value is None:
-        return None
-    import numpy as np
-    import pandas as pd
-    if isinstance(value, (np.integer,)):
+    # Cas courants (valeurs de ticker.info) : types natifs, sans chaine d'isinstance
+    value_type = type(value)
+    if value is None or value_type is int or value_type is str or value_type is bool:
+        return value
+    if value_type is float:
+        return value if not math.isnan(value) else None
+    if isinstance(value, np.integer):
         return int(value)
-    if isinstance(value, (np.floating,)):
+    if isinstance(value, np.floating):
         return float(value) if not np.isnan(value) else None
-    if isinstance(value, (np.bool_,)):
+    if isinstance(value, np.bool_):
         return bool(value)
-    if isinstance(value, (pd.Timestamp,)):
+    if isinstance(value, pd.Timestamp):
         return value.isoformat()
-    if isinstance(value, (float,)):
-        import math
+    if isinstance(value, float):
         return value if not math.isnan(value) else None
     return value
 
@@ -232,15 +320,19 @@ def extract_statement_data(stmt):
     """Extrait les donnees d'un etat financier en dict serialisable."""
     if stmt is None or stmt.empty:
         return None
-    result = {}
-    for col in stmt.columns:
-        col_key = col.isoformat() if hasattr(col, "isoformat") else str(col)
-        col_data = {}
-        for idx in stmt.index:
-            val = safe_convert(stmt.loc[idx, col])
-            col_data[str(idx)] = val
-        result[col_key] = col_data
-    return result
+    df = stmt.copy()
+    df.columns = [col.isoformat() if hasattr(col, "isoformat") else str(col) for col in df.columns]
+    df.index = df.index.astype(str)
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict()
+
+
+def read_statement(ticker, attr):
+    """Lit un etat financier d'un yf.Ticker (None si indisponible)."""
+    try:
+        return getattr(ticker, attr)
+    except Exception:
+        return None
 
 
 def fetch_company_fundamentals(company):
@@ -256,9 +348,10 @@ def fetch_company_fundamentals(company):
             print(f"  [CACHE] {ticker_str} (< 7 jours)")
             return
 
+    FUNDAMENTALS_LIMITER.wait()
     print(f"  [...] {ticker_str}...")
     try:
-        ticker = yf.Ticker(ticker_str)
+        ticker = get_ticker(ticker_str)
         info = ticker.info or {}
 
         fundamentals = {
@@ -299,69 +392,58 @@ def fetch_company_fundamentals(company):
             "num_analysts": safe_convert(info.get("numberOfAnalystOpinions")),
         }
 
-        # Etats financiers
+        # Etats financiers (lus une seule fois, reutilises pour les variations YoY)
+        income_df = read_statement(ticker, "income_stmt")
+        quarterly_df = read_statement(ticker, "quarterly_income_stmt")
+        balance_df = read_statement(ticker, "balance_sheet")
+        cashflow_df = read_statement(ticker, "cashflow")
+
         try:
-            fundamentals["income_stmt"] = extract_statement_data(ticker.income_stmt)
+            fundamentals["income_stmt"] = extract_statement_data(income_df)
         except Exception:
             fundamentals["income_stmt"] = None
 
         try:
-            fundamentals["quarterly_income"] = extract_statement_data(ticker.quarterly_income_stmt)
+            fundamentals["quarterly_income"] = extract_statement_data(quarterly_df)
         except Exception:
             fundamentals["quarterly_income"] = None
 
         try:
-            fundamentals["balance_sheet"] = extract_statement_data(ticker.balance_sheet)
+            fundamentals["balance_sheet"] = extract_statement_data(balance_df)
         except Exception:
             fundamentals["balance_sheet"] = None
 
         try:
-            fundamentals["cashflow"] = extract_statement_data(ticker.cashflow)
+            fundamentals["cashflow"] = extract_statement_data(cashflow_df)
         except Exception:
             fundamentals["cashflow"] = None
 
         # Estimations analystes
         try:
-            earnings_est = ticker.earnings_estimate
-            if earnings_est is not None and not earnings_est.empty:
-                fundamentals["earnings_estimate"] = json.loads(earnings_est.to_json())
-            else:
-                fundamentals["earnings_estimate"] = None
+            fundamentals["earnings_estimate"] = extract_statement_data(ticker.earnings_estimate)
         except Exception:
             fundamentals["earnings_estimate"] = None
 
         try:
-            revenue_est = ticker.revenue_estimate
-            if revenue_est is not None and not revenue_est.empty:
-                fundamentals["revenue_estimate"] = json.loads(revenue_est.to_json())
-            else:
-                fundamentals["revenue_estimate"] = None
+            fundamentals["revenue_estimate"] = extract_statement_data(ticker.revenue_estimate)
         except Exception:
             fundamentals["revenue_estimate"] = None
 
         try:
-            growth_est = ticker.growth_estimates
-            if growth_est is not None and not growth_est.empty:
-                fundamentals["growth_estimates"] = json.loads(growth_est.to_json())
-            else:
-                fundamentals["growth_estimates"] = None
+            fundamentals["growth_estimates"] = extract_statement_data(ticker.growth_estimates)
         except Exception:
             fundamentals["growth_estimates"] = None
 
         # Revenue/geo segmentation (si disponible)
         try:
-            seg = ticker.revenue_forecasts
-            if seg is not None and not seg.empty:
-                fundamentals["revenue_forecasts"] = json.loads(seg.to_json())
-            else:
-                fundamentals["revenue_forecasts"] = None
+            fundamentals["revenue_forecasts"] = extract_statement_data(ticker.revenue_forecasts)
         except Exception:
             fundamentals["revenue_forecasts"] = None
 
         # Compute YoY changes for profit margin and ROE
         try:
-            income = ticker.income_stmt
-            balance = ticker.balance_sheet
+            income = income_df
+            balance = balance_df
             if income is not None and not income.empty and balance is not None and not balance.empty:
                 # Get the two most recent annual periods
                 inc_cols = sorted(income.columns, reverse=True)
@@ -413,8 +495,11 @@ def fetch_company_fundamentals(company):
             fundamentals["profit_margin_yoy_change"] = None
             fundamentals["roe_yoy_change"] = None
 
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(fundamentals, f, ensure_ascii=False, indent=2)
+        dump_json(fundamentals, filepath)
+        _FUNDAMENTALS_MEMO[ticker_str] = {
+            "sector": fundamentals["sector"],
+            "industry": fundamentals["industry"],
+        }
         print(f"  [OK] {ticker_str}")
 
     except Exception as e:
@@ -427,9 +512,10 @@ def fetch_company_news(company):
     filename = ticker_to_filename(ticker_str)
     filepath = NEWS_DIR / f"{filename}.json"
 
+    NEWS_LIMITER.wait()
     print(f"  [...] News {ticker_str}...")
     try:
-        ticker = yf.Ticker(ticker_str)
+        ticker = get_ticker(ticker_str)
         raw_news = ticker.news or []
 
         news_items = []
@@ -443,8 +529,7 @@ def fetch_company_news(company):
                 "type": content.get("contentType", ""),
             })
 
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(news_items, f, ensure_ascii=False, indent=2)
+        dump_json(news_items, filepath)
         print(f"  [OK] News {ticker_str} ({len(news_items)} articles)")
 
     except Exception as e:
@@ -454,11 +539,10 @@ def fetch_company_news(company):
 def update_timestamp():
     """Met a jour le fichier last_updated.json."""
     path = DATA_DIR / "last_updated.json"
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump({
-            "timestamp": datetime.now().isoformat(),
-            "date": datetime.now().strftime("%d/%m/%Y %H:%M UTC"),
-        }, f, indent=2)
+    dump_json({
+        "timestamp": datetime.now().isoformat(),
+        "date": datetime.now().strftime("%d/%m/%Y %H:%M UTC"),
+    }, path, pretty=True)
     print(f"[OK] last_updated.json")
 
 
@@ -467,36 +551,32 @@ def main():
     print(f"Richelieu - Mise a jour des donnees - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
     print("=" * 60)
 
-    # 1. Generer companies.json
-    print("\n--- Generation companies.json ---")
-    generate_companies_json()
-
-    # 2. Prix batch
+    # 1. Prix batch
     print("\n--- Recuperation des prix ---")
     fetch_batch_prices()
 
-    # 2b. Historique 1 an (pour les graphiques)
+    # 1b. Historique 1 an (pour les graphiques)
     print("\n--- Recuperation historique 1 an ---")
     fetch_history()
 
-    # 2c. Indices G7 (20 ans mensuel pour le dashboard)
+    # 1c. Indices G7 (20 ans mensuel pour le dashboard)
     print("\n--- Recuperation indices G7 ---")
     fetch_indices()
 
-    # 3. Fondamentaux (avec delai entre chaque)
+    # 2. Fondamentaux (en parallele, cadence par FUNDAMENTALS_LIMITER)
     print("\n--- Recuperation des fondamentaux ---")
     all_companies = get_all_companies()
-    for i, company in enumerate(all_companies):
-        fetch_company_fundamentals(company)
-        if i < len(all_companies) - 1:
-            time.sleep(1.5)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(fetch_company_fundamentals, all_companies))
+
+    # 3. Generer companies.json (apres les fondamentaux pour sector/industry)
+    print("\n--- Generation companies.json ---")
+    generate_companies_json()
 
-    # 4. Actualites
+    # 4. Actualites (en parallele, cadence par NEWS_LIMITER)
     print("\n--- Recuperation des actualites ---")
-    for i, company in enumerate(all_companies):
-        fetch_company_news(company)
-        if i < len(all_companies) - 1:
-            time.sleep(0.5)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(fetch_company_news, all_companies))
 
     # 5. Timestamp
     print("\n--- Mise a jour timestamp ---")